@@ -2,25 +2,33 @@ from flask import Flask, request, render_template_string, url_for
 import io
 import base64
 import matplotlib.pyplot as plt
-import pandas as pd
 import subprocess
 import os
+import threading
 
 if not os.path.exists("probability_matrix_women_likes_men.csv"):
     print("detected first run. Attempting to generate csv templates.")
     subprocess.run(["python", "init.py"], check=True)
 
 import numpy as np 
-from backend import run_dating_simulation, all_men_ids, all_women_ids, all_user_ids
+from backend import run_dating_simulation, all_men_ids, all_women_ids, user_is_man
 
 app = Flask(__name__)
 
+# One results figure for the life of the process: each run clears and redraws
+# its axes instead of building a new figure. The lock stops concurrent
+# requests from drawing over each other.
+fig, axes = plt.subplots(nrows=3, ncols=2, figsize=(14,15))
+plot_lock = threading.Lock()
+
 @app.route("/", methods=["GET", "POST"])
 def index():
     if request.method == "POST":
         # Parse parameters from the form
         try:
             daily_queue_size = int(request.form.get("daily_queue_size", 5))
+            if daily_queue_size < 0:
+                raise ValueError("daily_queue_size must be non-negative")
             weight_reciprocal = float(request.form.get("weight_reciprocal", 1.0))
             weight_queue_penalty = float(request.form.get("weight_queue_penalty", 0.5))
             export_trace = request.form.get("export_trace") == "off"
@@ -32,7 +40,7 @@ def index():
             return "Invalid parameter(s) provided.", 400
 
         # Run the simulation
-        daily_logs, matches, incoming_likes = run_dating_simulation(
+        full_log, matched, incoming_likes = run_dating_simulation(
             daily_queue_size=daily_queue_size,
             weight_reciprocal=weight_reciprocal,
             weight_queue_penalty=weight_queue_penalty,
@@ -43,33 +51,41 @@ def index():
             plot_type=plot_type
         )
 
-        full_log = pd.concat(daily_logs, ignore_index=True)
-        likes_by_men = full_log[(full_log["UserID"].str.startswith("M")) & (full_log["Decision"]=="Like")].shape[0]
-        likes_by_women = full_log[(full_log["UserID"].str.startswith("W")) & (full_log["Decision"]=="Like")].shape[0]
+        # Views and likes by gender in one pass over the log:
+        # key = 2*is_man_user + is_like -> [women passes, women likes, men passes, men likes]
+        is_man_user = full_log["UserIsMan"].to_numpy()
+        is_like = (full_log["Decision"]=="Like").to_numpy()
+        view_counts = np.bincount(2*is_man_user + is_like, minlength=4)
+        likes_by_women = int(view_counts[1])
+        likes_by_men = int(view_counts[3])
         total_likes = likes_by_men + likes_by_women
-        unique_matches = sum(len(matches[uid]) for uid in all_men_ids)
+        # matched is a (woman, man) boolean matrix
+        women_match_counts = matched.sum(axis=1)
+        men_match_counts = matched.sum(axis=0)
+        unique_matches = int(matched.sum())
     
         # ----- NEW METRICS: Unseen & Stale Unseen Likes -----
         # Unseen likes: count of likes that were never seen by the recipient (still pending).
+        # incoming_likes[receiver] maps sender -> sent_day, all as user positions.
         unseen_likes_men = 0
         unseen_likes_women = 0
-        for uid in all_user_ids:
-            for sender, sent_day in incoming_likes[uid]:
-                if sender.startswith("M"):
+        for queue in incoming_likes:
+            for sender, sent_day in queue.items():
+                if user_is_man[sender]:
                     unseen_likes_men += 1
-                elif sender.startswith("W"):
+                else:
                     unseen_likes_women += 1
         total_unseen = unseen_likes_men + unseen_likes_women
         
         # Stale Unseen likes: count of unseen likes that were not sent on day 3.
         stale_likes_men = 0
         stale_likes_women = 0
-        for uid in all_user_ids:
-            for sender, sent_day in incoming_likes[uid]:
+        for queue in incoming_likes:
+            for sender, sent_day in queue.items():
                 if sent_day != 3:
-                    if sender.startswith("M"):
+                    if user_is_man[sender]:
                         stale_likes_men += 1
-                    elif sender.startswith("W"):
+                    else:
                         stale_likes_women += 1
         total_stale = stale_likes_men + stale_likes_women
         
@@ -79,10 +95,10 @@ def index():
 
         # ----- NEW METRICS: Profile views and counts of users with at least one match -----
         profile_views_total = full_log.shape[0]
-        profile_views_men = full_log[full_log["UserID"].str.startswith("M")].shape[0]
-        profile_views_women = full_log[full_log["UserID"].str.startswith("W")].shape[0]
-        men_with_matches = sum(1 for uid in all_men_ids if len(matches[uid]) > 0)
-        women_with_matches = sum(1 for uid in all_women_ids if len(matches[uid]) > 0)
+        profile_views_men = int(view_counts[2] + view_counts[3])
+        profile_views_women = int(view_counts[0] + view_counts[1])
+        men_with_matches = int((men_match_counts > 0).sum())
+        women_with_matches = int((women_match_counts > 0).sum())
 
         # Prepare summary HTML with new content and structure.
         summary_html = f"""
@@ -120,186 +136,181 @@ def index():
         # Generate plots
         plot_img = None
         if show_match_plots or show_like_plots:
-            fig, axes = plt.subplots(nrows=3, ncols=2, figsize=(14,15))
 
             # For bar chart plots, we want to sort individuals by match count for consistency.
-            men_matches = sorted([(uid, len(matches[uid])) for uid in all_men_ids], key=lambda x: x[1])
-            women_matches = sorted([(uid, len(matches[uid])) for uid in all_women_ids], key=lambda x: x[1])
+            men_matches = sorted(zip(all_men_ids, men_match_counts.tolist()), key=lambda x: x[1])
+            women_matches = sorted(zip(all_women_ids, women_match_counts.tolist()), key=lambda x: x[1])
             
-            # Prepare likes sent counts using full_log
-            men_likes_sent = []
-            for uid, _ in men_matches:
-                count = full_log[(full_log["UserID"]==uid) & (full_log["Decision"]=="Like")].shape[0]
-                men_likes_sent.append(count)
-            women_likes_sent = []
-            for uid, _ in women_matches:
-                count = full_log[(full_log["UserID"]==uid) & (full_log["Decision"]=="Like")].shape[0]
-                women_likes_sent.append(count)
+            # Per-user like counts from one pass over the liked rows of full_log
+            liked_rows = full_log[is_like]
+            sent_counts = liked_rows["UserID"].value_counts()
+            received_counts = liked_rows["CandidateID"].value_counts()
+
+            # Prepare likes sent counts (sorted by match count)
+            men_likes_sent = [int(sent_counts.get(uid, 0)) for uid, _ in men_matches]
+            women_likes_sent = [int(sent_counts.get(uid, 0)) for uid, _ in women_matches]
             
-            # Prepare likes received counts using full_log (sorted by match count)
-            men_likes_received = []
-            for uid, _ in men_matches:
-                count = full_log[(full_log["CandidateID"]==uid) & (full_log["Decision"]=="Like")].shape[0]
-                men_likes_received.append(count)
-            women_likes_received = []
-            for uid, _ in women_matches:
-                count = full_log[(full_log["CandidateID"]==uid) & (full_log["Decision"]=="Like")].shape[0]
-                women_likes_received.append(count)
+            # Prepare likes received counts (sorted by match count)
+            men_likes_received = [int(received_counts.get(uid, 0)) for uid, _ in men_matches]
+            women_likes_received = [int(received_counts.get(uid, 0)) for uid, _ in women_matches]
+
+            with plot_lock:
+                for ax in axes.flat:
+                    ax.cla()
 
-            if plot_type == "Bar Chart":
-              # Match plots - Bar Chart
-              if show_match_plots:
-                  axes[0,0].bar(range(len(men_matches)), [x[1] for x in men_matches],
-                              color="skyblue", edgecolor="black")
-                  axes[0,0].set_title("Men's Match Counts (Sorted)")
-                  axes[0,0].set_xlabel("Men (sorted by match count)")
-                  axes[0,0].set_ylabel("Number of Matches")
+                if plot_type == "Bar Chart":
+                  # Match plots - Bar Chart
+                  if show_match_plots:
+                      axes[0,0].bar(range(len(men_matches)), [x[1] for x in men_matches],
+                                  color="skyblue", edgecolor="black")
+                      axes[0,0].set_title("Men's Match Counts (Sorted)")
+                      axes[0,0].set_xlabel("Men (sorted by match count)")
+                      axes[0,0].set_ylabel("Number of Matches")
                   
-                  axes[0,1].bar(range(len(women_matches)), [x[1] for x in women_matches],
-                              color="lightpink", edgecolor="black")
-                  axes[0,1].set_title("Women's Match Counts (Sorted)")
-                  axes[0,1].set_xlabel("Women (sorted by match count)")
-                  axes[0,1].set_ylabel("Number of Matches")
-              else:
-                  axes[0,0].axis('off')
-                  axes[0,1].axis('off')
+                      axes[0,1].bar(range(len(women_matches)), [x[1] for x in women_matches],
+                                  color="lightpink", edgecolor="black")
+                      axes[0,1].set_title("Women's Match Counts (Sorted)")
+                      axes[0,1].set_xlabel("Women (sorted by match count)")
+                      axes[0,1].set_ylabel("Number of Matches")
+                  else:
+                      axes[0,0].axis('off')
+                      axes[0,1].axis('off')
               
-              # Like plots - Likes Sent (Bar Chart)
-              if show_like_plots:
-                  axes[1,0].bar(range(len(men_matches)), men_likes_sent,
-                              color="skyblue", edgecolor="black")
-                  axes[1,0].set_title("Men's Likes Sent (Sorted by Match Count)")
-                  axes[1,0].set_xlabel("Men (sorted by match count)")
-                  axes[1,0].set_ylabel("Number of Likes Sent")
+                  # Like plots - Likes Sent (Bar Chart)
+                  if show_like_plots:
+                      axes[1,0].bar(range(len(men_matches)), men_likes_sent,
+                                  color="skyblue", edgecolor="black")
+                      axes[1,0].set_title("Men's Likes Sent (Sorted by Match Count)")
+                      axes[1,0].set_xlabel("Men (sorted by match count)")
+                      axes[1,0].set_ylabel("Number of Likes Sent")
                   
-                  axes[1,1].bar(range(len(women_matches)), women_likes_sent,
-                              color="lightpink", edgecolor="black")
-                  axes[1,1].set_title("Women's Likes Sent (Sorted by Match Count)")
-                  axes[1,1].set_xlabel("Women (sorted by match count)")
-                  axes[1,1].set_ylabel("Number of Likes Sent")
-              else:
-                  axes[1,0].axis('off')
-                  axes[1,1].axis('off')
+                      axes[1,1].bar(range(len(women_matches)), women_likes_sent,
+                                  color="lightpink", edgecolor="black")
+                      axes[1,1].set_title("Women's Likes Sent (Sorted by Match Count)")
+                      axes[1,1].set_xlabel("Women (sorted by match count)")
+                      axes[1,1].set_ylabel("Number of Likes Sent")
+                  else:
+                      axes[1,0].axis('off')
+                      axes[1,1].axis('off')
                   
-              # Likes Received plots - Bar Chart
-              if show_like_plots:
-                  axes[2,0].bar(range(len(men_matches)), men_likes_received,
-                              color="skyblue", edgecolor="black")
-                  axes[2,0].set_title("Men's Likes Received (Sorted by Match Count)")
-                  axes[2,0].set_xlabel("Men (sorted by match count)")
-                  axes[2,0].set_ylabel("Number of Likes Received")
+                  # Likes Received plots - Bar Chart
+                  if show_like_plots:
+                      axes[2,0].bar(range(len(men_matches)), men_likes_received,
+                                  color="skyblue", edgecolor="black")
+                      axes[2,0].set_title("Men's Likes Received (Sorted by Match Count)")
+                      axes[2,0].set_xlabel("Men (sorted by match count)")
+                      axes[2,0].set_ylabel("Number of Likes Received")
                   
-                  axes[2,1].bar(range(len(women_matches)), women_likes_received,
-                              color="lightpink", edgecolor="black")
-                  axes[2,1].set_title("Women's Likes Received (Sorted by Match Count)")
-                  axes[2,1].set_xlabel("Women (sorted by match count)")
-                  axes[2,1].set_ylabel("Number of Likes Received")
-              else:
-                  axes[2,0].axis('off')
-                  axes[2,1].axis('off')
+                      axes[2,1].bar(range(len(women_matches)), women_likes_received,
+                                  color="lightpink", edgecolor="black")
+                      axes[2,1].set_title("Women's Likes Received (Sorted by Match Count)")
+                      axes[2,1].set_xlabel("Women (sorted by match count)")
+                      axes[2,1].set_ylabel("Number of Likes Received")
+                  else:
+                      axes[2,0].axis('off')
+                      axes[2,1].axis('off')
 
-            elif plot_type == "Histogram":
-              # Fixed bin labels for histogram plots.
-              bin_labels = ["0", "1-3", "4-7", "8+"]
-              # Function to compute histogram counts for fixed bins:
-              # - Count exactly 0, counts between 1 and 2, between 3 and 4, and 5 or more.
-              def compute_hist_counts(data):
-                  data = np.array(data)
-                  bin0 = np.sum(data == 0)
-                  bin1 = np.sum((data >= 1) & (data <= 3))
-                  bin2 = np.sum((data >= 4) & (data <= 7))
-                  bin3 = np.sum(data >= 8)
-                  return [bin0, bin1, bin2, bin3]
+                elif plot_type == "Histogram":
+                  # Fixed bin labels for histogram plots.
+                  bin_labels = ["0", "1-3", "4-7", "8+"]
+                  # Function to compute histogram counts for fixed bins:
+                  # - Count exactly 0, counts between 1 and 2, between 3 and 4, and 5 or more.
+                  def compute_hist_counts(data):
+                      data = np.array(data)
+                      bin0 = np.sum(data == 0)
+                      bin1 = np.sum((data >= 1) & (data <= 3))
+                      bin2 = np.sum((data >= 4) & (data <= 7))
+                      bin3 = np.sum(data >= 8)
+                      return [bin0, bin1, bin2, bin3]
               
-              # Compute histogram counts for matches and likes.
-              men_match_data = [x[1] for x in men_matches]
-              women_match_data = [x[1] for x in women_matches]
-              men_match_hist = compute_hist_counts(men_match_data)
-              women_match_hist = compute_hist_counts(women_match_data)
-              men_likes_hist = compute_hist_counts(men_likes_sent)
-              women_likes_hist = compute_hist_counts(women_likes_sent)
-              men_likes_received_hist = compute_hist_counts(men_likes_received)
-              women_likes_received_hist = compute_hist_counts(women_likes_received)
+                  # Compute histogram counts for matches and likes.
+                  men_match_data = [x[1] for x in men_matches]
+                  women_match_data = [x[1] for x in women_matches]
+                  men_match_hist = compute_hist_counts(men_match_data)
+                  women_match_hist = compute_hist_counts(women_match_data)
+                  men_likes_hist = compute_hist_counts(men_likes_sent)
+                  women_likes_hist = compute_hist_counts(women_likes_sent)
+                  men_likes_received_hist = compute_hist_counts(men_likes_received)
+                  women_likes_received_hist = compute_hist_counts(women_likes_received)
               
-              # Men's match histogram
-              if show_match_plots:
-                  axes[0,0].bar(range(len(men_match_hist)), men_match_hist,
-                                color="skyblue", edgecolor="black", width=0.8)
-                  axes[0,0].set_title("Histogram of Men's Match Counts")
-                  axes[0,0].set_xlabel("Match Count Bins")
-                  axes[0,0].set_ylabel("Number of Men")
-                  axes[0,0].set_xticks(range(len(bin_labels)))
-                  axes[0,0].set_xticklabels(bin_labels)
-              else:
-                  axes[0,0].axis('off')
+                  # Men's match histogram
+                  if show_match_plots:
+                      axes[0,0].bar(range(len(men_match_hist)), men_match_hist,
+                                    color="skyblue", edgecolor="black", width=0.8)
+                      axes[0,0].set_title("Histogram of Men's Match Counts")
+                      axes[0,0].set_xlabel("Match Count Bins")
+                      axes[0,0].set_ylabel("Number of Men")
+                      axes[0,0].set_xticks(range(len(bin_labels)))
+                      axes[0,0].set_xticklabels(bin_labels)
+                  else:
+                      axes[0,0].axis('off')
               
-              # Women's match histogram
-              if show_match_plots:
-                  axes[0,1].bar(range(len(women_match_hist)), women_match_hist,
-                                color="lightpink", edgecolor="black", width=0.8)
-                  axes[0,1].set_title("Histogram of Women's Match Counts")
-                  axes[0,1].set_xlabel("Match Count Bins")
-                  axes[0,1].set_ylabel("Number of Women")
-                  axes[0,1].set_xticks(range(len(bin_labels)))
-                  axes[0,1].set_xticklabels(bin_labels)
-              else:
-                  axes[0,1].axis('off')
+                  # Women's match histogram
+                  if show_match_plots:
+                      axes[0,1].bar(range(len(women_match_hist)), women_match_hist,
+                                    color="lightpink", edgecolor="black", width=0.8)
+                      axes[0,1].set_title("Histogram of Women's Match Counts")
+                      axes[0,1].set_xlabel("Match Count Bins")
+                      axes[0,1].set_ylabel("Number of Women")
+                      axes[0,1].set_xticks(range(len(bin_labels)))
+                      axes[0,1].set_xticklabels(bin_labels)
+                  else:
+                      axes[0,1].axis('off')
               
-              # Men's likes sent histogram
-              if show_like_plots:
-                  axes[1,0].bar(range(len(men_likes_hist)), men_likes_hist,
-                                color="skyblue", edgecolor="black", width=0.8)
-                  axes[1,0].set_title("Histogram of Men's Likes Sent")
-                  axes[1,0].set_xlabel("Likes Sent Count Bins")
-                  axes[1,0].set_ylabel("Number of Men")
-                  axes[1,0].set_xticks(range(len(bin_labels)))
-                  axes[1,0].set_xticklabels(bin_labels)
-              else:
-                  axes[1,0].axis('off')
+                  # Men's likes sent histogram
+                  if show_like_plots:
+                      axes[1,0].bar(range(len(men_likes_hist)), men_likes_hist,
+                                    color="skyblue", edgecolor="black", width=0.8)
+                      axes[1,0].set_title("Histogram of Men's Likes Sent")
+                      axes[1,0].set_xlabel("Likes Sent Count Bins")
+                      axes[1,0].set_ylabel("Number of Men")
+                      axes[1,0].set_xticks(range(len(bin_labels)))
+                      axes[1,0].set_xticklabels(bin_labels)
+                  else:
+                      axes[1,0].axis('off')
               
-              # Women's likes sent histogram
-              if show_like_plots:
-                  axes[1,1].bar(range(len(women_likes_hist)), women_likes_hist,
-                                color="lightpink", edgecolor="black", width=0.8)
-                  axes[1,1].set_title("Histogram of Women's Likes Sent")
-                  axes[1,1].set_xlabel("Likes Sent Count Bins")
-                  axes[1,1].set_ylabel("Number of Women")
-                  axes[1,1].set_xticks(range(len(bin_labels)))
-                  axes[1,1].set_xticklabels(bin_labels)
-              else:
-                  axes[1,1].axis('off')
+                  # Women's likes sent histogram
+                  if show_like_plots:
+                      axes[1,1].bar(range(len(women_likes_hist)), women_likes_hist,
+                                    color="lightpink", edgecolor="black", width=0.8)
+                      axes[1,1].set_title("Histogram of Women's Likes Sent")
+                      axes[1,1].set_xlabel("Likes Sent Count Bins")
+                      axes[1,1].set_ylabel("Number of Women")
+                      axes[1,1].set_xticks(range(len(bin_labels)))
+                      axes[1,1].set_xticklabels(bin_labels)
+                  else:
+                      axes[1,1].axis('off')
                   
-              # Men's likes received histogram
-              if show_like_plots:
-                  axes[2,0].bar(range(len(men_likes_received_hist)), men_likes_received_hist,
-                                color="skyblue", edgecolor="black", width=0.8)
-                  axes[2,0].set_title("Histogram of Men's Likes Received")
-                  axes[2,0].set_xlabel("Likes Received Count Bins")
-                  axes[2,0].set_ylabel("Number of Men")
-                  axes[2,0].set_xticks(range(len(bin_labels)))
-                  axes[2,0].set_xticklabels(bin_labels)
-              else:
-                  axes[2,0].axis('off')
+                  # Men's likes received histogram
+                  if show_like_plots:
+                      axes[2,0].bar(range(len(men_likes_received_hist)), men_likes_received_hist,
+                                    color="skyblue", edgecolor="black", width=0.8)
+                      axes[2,0].set_title("Histogram of Men's Likes Received")
+                      axes[2,0].set_xlabel("Likes Received Count Bins")
+                      axes[2,0].set_ylabel("Number of Men")
+                      axes[2,0].set_xticks(range(len(bin_labels)))
+                      axes[2,0].set_xticklabels(bin_labels)
+                  else:
+                      axes[2,0].axis('off')
               
-              # Women's likes received histogram
-              if show_like_plots:
-                  axes[2,1].bar(range(len(women_likes_received_hist)), women_likes_received_hist,
-                                color="lightpink", edgecolor="black", width=0.8)
-                  axes[2,1].set_title("Histogram of Women's Likes Received")
-                  axes[2,1].set_xlabel("Likes Received Count Bins")
-                  axes[2,1].set_ylabel("Number of Women")
-                  axes[2,1].set_xticks(range(len(bin_labels)))
-                  axes[2,1].set_xticklabels(bin_labels)
-              else:
-                  axes[2,1].axis('off')
+                  # Women's likes received histogram
+                  if show_like_plots:
+                      axes[2,1].bar(range(len(women_likes_received_hist)), women_likes_received_hist,
+                                    color="lightpink", edgecolor="black", width=0.8)
+                      axes[2,1].set_title("Histogram of Women's Likes Received")
+                      axes[2,1].set_xlabel("Likes Received Count Bins")
+                      axes[2,1].set_ylabel("Number of Women")
+                      axes[2,1].set_xticks(range(len(bin_labels)))
+                      axes[2,1].set_xticklabels(bin_labels)
+                  else:
+                      axes[2,1].axis('off')
             
-            plt.tight_layout()
+                fig.tight_layout()
             
-            buf = io.BytesIO()
-            plt.savefig(buf, format="svg")
-            buf.seek(0)
-            plot_img = base64.b64encode(buf.getvalue()).decode("utf8")
-            plt.close(fig)
+                buf = io.BytesIO()
+                fig.savefig(buf, format="svg")
+                buf.seek(0)
+                plot_img = base64.b64encode(buf.getvalue()).decode("utf8")
         # TODO: add full simulation trace exports as xlsx, when ready; use download prop
         # Jack & Jill traces too
         return render_template_string("""
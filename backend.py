@@ -1,17 +1,17 @@
+import os
 import numpy as np
 import pandas as pd
-import random
 import matplotlib.pyplot as plt
-import openpyxl  # for Excel export
+import xlsxwriter  # for Excel export
 
 ##############################################################################
 # 1) PRELOAD THE CSVs (PROFILES & PROBABILITY MATRICES)
 ##############################################################################
-women_df = pd.read_csv("synthetic_women_profiles.csv")
-men_df   = pd.read_csv("synthetic_men_profiles.csv")
+WOMEN_PROFILES_CSV = "synthetic_women_profiles.csv"
+MEN_PROFILES_CSV   = "synthetic_men_profiles.csv"
 
-prob_women_likes_men = pd.read_csv("probability_matrix_women_likes_men.csv", index_col=0)
-prob_men_likes_women = pd.read_csv("probability_matrix_men_likes_women.csv", index_col=0)
+women_df = pd.read_csv(WOMEN_PROFILES_CSV)
+men_df   = pd.read_csv(MEN_PROFILES_CSV)
 
 # Create lookup dictionaries for profile info.
 women_info = {row["WomanID"]: row for _, row in women_df.iterrows()}
@@ -21,16 +21,51 @@ all_women_ids = list(women_info.keys())
 all_men_ids   = list(men_info.keys())
 all_user_ids  = all_women_ids + all_men_ids
 
+# Inside the simulation a user is their integer position in all_user_ids:
+# women are 0..n_women-1 and men follow. String IDs only come back for the trace.
+n_women = len(all_women_ids)
+n_men   = len(all_men_ids)
+n_users = n_women + n_men
+user_is_man = np.arange(n_users) >= n_women
+user_id_arr = np.array(all_user_ids)   # position -> string ID, for the trace
+
+def load_prob_matrix(name, row_ids, col_ids):
+    """
+    Loads a probability matrix as a plain float32 ndarray laid out in profile
+    order, so a user's position in all_women_ids / all_men_ids is also their
+    row/column. Probabilities don't need float64; float32 halves the bytes
+    read per candidate row.
+
+    init.py writes a .npy copy next to each CSV. It carries no labels, so it is
+    only memory-mapped (no parsing, pages shared between processes) when it is
+    at least as new as both the matrix CSV and the profile CSVs that define
+    the ID order, and its shape matches the current profiles. Otherwise the
+    CSV is parsed and reordered by ID, which raises KeyError on a mismatch.
+    """
+    csv_path, npy_path = name + ".csv", name + ".npy"
+    sources = [csv_path, WOMEN_PROFILES_CSV, MEN_PROFILES_CSV]
+    if os.path.exists(npy_path) and all(
+            not os.path.exists(src) or os.path.getmtime(npy_path) >= os.path.getmtime(src)
+            for src in sources):
+        arr = np.load(npy_path, mmap_mode="r")
+        if arr.shape == (len(row_ids), len(col_ids)):
+            return arr.astype(np.float32, copy=False)
+    return pd.read_csv(csv_path, index_col=0).loc[row_ids, col_ids].to_numpy(dtype=np.float32)
+
+# Scalar reads from these skip pandas' label resolution entirely.
+P_wm = load_prob_matrix("probability_matrix_women_likes_men", all_women_ids, all_men_ids)
+P_mw = load_prob_matrix("probability_matrix_men_likes_women", all_men_ids, all_women_ids)
+
 ##############################################################################
 # 1.5) SELECT "JACK" AND "JILL" AS MIDDLE-PERFORMING PROFILES
 ##############################################################################
-man_avgs = prob_women_likes_men.mean(axis=0)
+man_avgs = P_wm.mean(axis=0, dtype=np.float64)
 overall_man_avg = man_avgs.mean()
-jack_id = (man_avgs - overall_man_avg).abs().idxmin()
+jack_id = all_men_ids[np.abs(man_avgs - overall_man_avg).argmin()]
 
-woman_avgs = prob_men_likes_women.mean(axis=0)
+woman_avgs = P_mw.mean(axis=0, dtype=np.float64)
 overall_woman_avg = woman_avgs.mean()
-jill_id = (woman_avgs - overall_woman_avg).abs().idxmin()
+jill_id = all_women_ids[np.abs(woman_avgs - overall_woman_avg).argmin()]
 
 print(f"Selected Jack: {jack_id}, Selected Jill: {jill_id}")
 
@@ -64,120 +99,208 @@ def run_dating_simulation(
             S₍ᵢⱼ₎ = Pᵢⱼ * 1/(1 + w_queue*Qⱼ) * (Pⱼᵢ)^(w_reciprocal)
 
     Extra metrics (unseen and stale unseen likes) and Jack & Jill trace export are also provided.
+
+    With export_trace / export_jack_jill_trace set, the full trace / the rows
+    involving Jack or Jill are written as .xlsx to trace_out / trace_jj_out,
+    each a path or a binary file-like object such as io.BytesIO. Nothing is
+    written unless the caller passes a destination.
     """
-    # Set seeds for reproducibility.
-    np.random.seed(random_seed)
-    random.seed(random_seed)
+    # One seeded generator drives login order and like/pass rolls.
+    rng = np.random.default_rng(random_seed)
+    
+    # Pᵢⱼ * (Pⱼᵢ)^(w_reciprocal) is the part of every fresh score that doesn't
+    # depend on simulation state, so compute it for all users in one pass.
+    # Reciprocal matrices are transposed so row ui lines up with the user's own
+    # probability row. Only the queue penalty is left for login time, since
+    # queues change as users act.
+    if weight_reciprocal == 1.0:
+        # Common default: plain product, no pow
+        fresh_base_women = np.multiply(P_wm, P_mw.T, order="C")   # (woman, man)
+        fresh_base_men = np.multiply(P_mw, P_wm.T, order="C")     # (man, woman)
+    elif weight_reciprocal == 0.0:
+        # (Pⱼᵢ)^0 == 1: fresh scores start from Pᵢⱼ itself
+        fresh_base_women = P_wm
+        fresh_base_men = P_mw
+    else:
+        fresh_base_women = P_wm * np.power(P_mw.T, weight_reciprocal, order="C")
+        fresh_base_men = P_mw * np.power(P_wm.T, weight_reciprocal, order="C")
     
     # Simulation state dictionaries.
-    incoming_likes = {uid: [] for uid in all_user_ids}   # store (sender, sent_day)
-    matches = {uid: set() for uid in all_user_ids}
-    likes_sent = {uid: set() for uid in all_user_ids}
-    daily_logs = []  # one DataFrame per day
+    incoming_likes = [{} for _ in range(n_users)]   # receiver -> {sender: sent_day}
+    # Match and like-sent state as (woman, man) / (man, woman) boolean matrices.
+    matched = np.zeros((n_women, n_men), dtype=bool)
+    likes_sent_wm = np.zeros((n_women, n_men), dtype=bool)  # woman liked man
+    likes_sent_mw = np.zeros((n_men, n_women), dtype=bool)  # man liked woman
+    # Pending-like counts (Qⱼ), kept in step with incoming_likes so scoring
+    # can read a whole side of the market as one vector. Held as float32 (exact
+    # for any realistic count) so the queue penalty stays in single precision.
+    queue_len_women = np.zeros(n_women, dtype=np.float32)
+    queue_len_men = np.zeros(n_men, dtype=np.float32)
+    # Trace columns, preallocated for the most rows the run can produce and
+    # filled by index; the DataFrame is built once at the end.
+    # Nobody can be shown more than the whole opposite side per login, so a
+    # larger daily_queue_size just means "everyone left"; size storage from this.
+    picks = min(daily_queue_size, max(n_women, n_men))
+    max_rows = num_days * n_users * picks
+    log_day = np.empty(max_rows, dtype=np.int32)
+    log_user = np.empty(max_rows, dtype=np.int32)
+    log_cand = np.empty(max_rows, dtype=np.int32)
+    log_score = np.empty(max_rows, dtype=np.float32)
+    log_incoming = np.empty(max_rows, dtype=bool)      # Source == "incoming"
+    log_like_prob = np.empty(max_rows, dtype=np.float32)
+    log_roll = np.empty(max_rows, dtype=np.float64)
+    log_like = np.empty(max_rows, dtype=bool)          # Decision == "Like"
+    log_match = np.empty(max_rows, dtype=bool)
+    log_delay = np.empty(max_rows, dtype=np.int32)
+    n_rows = 0
 
     # NEW: Track who each user has "already_seen" so they won't reappear.
-    already_seen = {uid: set() for uid in all_user_ids}
+    # One boolean row per viewer, indexed by candidate position.
+    seen_by_women = np.zeros((n_women, n_men), dtype=bool)
+    seen_by_men = np.zeros((n_men, n_women), dtype=bool)
     
     # Run simulation for num_days
     for day in range(1, num_days + 1):
-        day_records = []
-        login_order = all_user_ids.copy()
-        random.shuffle(login_order)
+        login_order = rng.permutation(n_users)
+        # Every roll the day can need, drawn in one call: row = login position
+        rolls = rng.random((n_users, picks))
         
-        for user in login_order:
-            # Opposite-gender pool, not matched yet, not already seen
-            if user.startswith("W"):
-                candidate_pool = [
-                    cid for cid in all_men_ids
-                    if cid not in matches[user] and cid not in already_seen[user]
-                ]
-                get_prob = lambda cand: prob_women_likes_men.loc[user, cand]
-                get_reciprocal = lambda cand: prob_men_likes_women.loc[cand, user]
+        for pos, user in enumerate(login_order):
+            # Opposite-gender side of the market, as seen from this user
+            if not user_is_man[user]:
+                ui = user                # row in the (woman, man) matrices
+                cand_offset = n_women    # cand user index = cand_offset + column
+                probs = P_wm[ui]         # P(user likes cand) for every man
+                fresh_base = fresh_base_women[ui]   # Pᵢⱼ (Pⱼᵢ)^w for every man
+                q = queue_len_men        # pending likes for every man
+                own_queue = queue_len_women   # pending likes for this user's side
+                already_seen = seen_by_women[ui]
+                matched_with = matched[ui]
+                liked = likes_sent_wm[ui]          # has user liked cand
+                liked_by = likes_sent_mw[:, ui]    # has cand liked user
             else:
-                candidate_pool = [
-                    cid for cid in all_women_ids
-                    if cid not in matches[user] and cid not in already_seen[user]
-                ]
-                get_prob = lambda cand: prob_men_likes_women.loc[user, cand]
-                get_reciprocal = lambda cand: prob_women_likes_men.loc[cand, user]
+                ui = user - n_women
+                cand_offset = 0
+                probs = P_mw[ui]
+                fresh_base = fresh_base_men[ui]
+                q = queue_len_women
+                own_queue = queue_len_men
+                already_seen = seen_by_men[ui]
+                matched_with = matched[:, ui]
+                liked = likes_sent_mw[ui]
+                liked_by = likes_sent_wm[:, ui]
+
+            # Candidate pool: not matched yet, not already seen
+            in_pool = ~(already_seen | matched_with)
             
-            # Build lookup of incoming likes (keep earliest day if multiple)
-            incoming_for_user = {}
-            for sender, sent_day in incoming_likes[user]:
-                if sender not in incoming_for_user or sent_day < incoming_for_user[sender]:
-                    incoming_for_user[sender] = sent_day
+            # Score every candidate at once as fresh (queue penalty and
+            # reciprocal term), then rescore the few incoming likes still
+            # waiting for this user on Pᵢⱼ alone.
+            scores = fresh_base / (1 + weight_queue_penalty * q)
+            incoming_for_user = incoming_likes[user]
+            incoming_cols = [s - cand_offset for s in incoming_for_user]
+            scores[incoming_cols] = probs[incoming_cols]
             
-            # Combine "incoming" or "fresh"
-            candidate_info = []
-            for cand in candidate_pool:
+            # Pick top daily_queue_size by descending score. argpartition finds
+            # them in O(n); only those few are then sorted (stable, so ties
+            # keep ID order).
+            pool = np.flatnonzero(in_pool)
+            if len(pool) > daily_queue_size:
+                top = np.sort(np.argpartition(-scores[pool], daily_queue_size)[:daily_queue_size])
+                pool = pool[top]
+            selected = pool[np.argsort(-scores[pool], kind="stable")]
+            
+            # Process each selected candidate
+            for k, ci in enumerate(selected):
+                cand = cand_offset + ci
                 if cand in incoming_for_user:
-                    score = get_prob(cand)
                     source = "incoming"
-                    sent_d = incoming_for_user[cand]
+                    sent_day = incoming_for_user[cand]
                 else:
-                    q = len(incoming_likes[cand])  # pending likes for cand
-                    score = get_prob(cand) * (1/(1 + weight_queue_penalty * q)) \
-                            * (get_reciprocal(cand) ** weight_reciprocal)
                     source = "fresh"
-                    sent_d = day
-                candidate_info.append({
-                    "CandidateID": cand,
-                    "Score": score,
-                    "Source": source,
-                    "SentDay": sent_d
-                })
-            
-            # Sort by descending score, pick top daily_queue_size
-            candidate_info_sorted = sorted(candidate_info, key=lambda x: x["Score"], reverse=True)
-            selected_candidates = candidate_info_sorted[:daily_queue_size]
-            
-            # Process each selected candidate
-            for cand_record in selected_candidates:
-                cand = cand_record["CandidateID"]
-                source = cand_record["Source"]
-                sent_day = cand_record["SentDay"]
-                like_prob = get_prob(cand)
-                roll = np.random.rand()
+                    sent_day = day
+                like_prob = probs[ci]
+                roll = rolls[pos, k]
                 decision = "Pass"
                 match_formed = False
 
                 # Remove pending like as soon as user sees it (fix for unseen-likes logic).
                 if source == "incoming":
-                    for idx, (s, sd) in enumerate(incoming_likes[user]):
-                        if s == cand:
-                            del incoming_likes[user][idx]
-                            break
+                    del incoming_for_user[cand]
+                    own_queue[ui] -= 1
 
                 # Decide "Like" or "Pass"
                 if roll < like_prob:
                     decision = "Like"
-                    if user in likes_sent[cand]:
+                    if liked_by[ci]:
                         # cand had previously liked user => match
                         match_formed = True
-                        matches[user].add(cand)
-                        matches[cand].add(user)
+                        matched_with[ci] = True
                     else:
-                        likes_sent[user].add(cand)
+                        liked[ci] = True
                         if source == "fresh":
-                            incoming_likes[cand].append((user, day))
+                            incoming_likes[cand].setdefault(user, day)
+                            q[ci] += 1
                 
-                delay = day - sent_day
-                day_records.append({
-                    "Day": day,
-                    "UserID": user,
-                    "CandidateID": cand,
-                    "Score": cand_record["Score"],
-                    "Source": source,
-                    "LikeProbability": like_prob,
-                    "RandomRoll": roll,
-                    "Decision": decision,
-                    "MatchFormed": match_formed,
-                    "Delay": delay
-                })
+                log_day[n_rows] = day
+                log_user[n_rows] = user
+                log_cand[n_rows] = cand
+                log_score[n_rows] = scores[ci]
+                log_incoming[n_rows] = source == "incoming"
+                log_like_prob[n_rows] = like_prob
+                log_roll[n_rows] = roll
+                log_like[n_rows] = decision == "Like"
+                log_match[n_rows] = match_formed
+                log_delay[n_rows] = day - sent_day
+                n_rows += 1
 
                 # Mark cand as seen so user won't see them again in future
-                already_seen[user].add(cand)
-        
-        daily_logs.append(pd.DataFrame(day_records))
+                already_seen[ci] = True
     
-    return daily_logs, matches, incoming_likes
\ No newline at end of file
+    full_log = pd.DataFrame({
+        "Day": log_day[:n_rows],
+        "UserID": user_id_arr[log_user[:n_rows]],
+        "CandidateID": user_id_arr[log_cand[:n_rows]],
+        "Score": log_score[:n_rows],
+        "Source": pd.Categorical.from_codes(log_incoming[:n_rows].astype(np.int8),
+                                            categories=["fresh", "incoming"]),
+        "LikeProbability": log_like_prob[:n_rows],
+        "RandomRoll": log_roll[:n_rows],
+        "Decision": pd.Categorical.from_codes(log_like[:n_rows].astype(np.int8),
+                                              categories=["Pass", "Like"]),
+        "MatchFormed": log_match[:n_rows],
+        "Delay": log_delay[:n_rows],
+        # Gender flags, so filters on the log never have to parse ID strings
+        "UserIsMan": user_is_man[log_user[:n_rows]],
+        "CandidateIsMan": user_is_man[log_cand[:n_rows]],
+    })
+    
+    if export_trace and trace_out is not None:
+        export_trace_to_excel(full_log, trace_out)
+    if export_jack_jill_trace and trace_jj_out is not None:
+        jj_rows = full_log["UserID"].isin([jack_id, jill_id]) \
+                  | full_log["CandidateID"].isin([jack_id, jill_id])
+        export_trace_to_excel(full_log[jj_rows], trace_jj_out)
+    
+    return full_log, matched, incoming_likes
+
+##############################################################################
+# 3) EXCEL TRACE EXPORT
+##############################################################################
+def export_trace_to_excel(trace, target):
+    """
+    Writes a simulation trace to an Excel workbook, one sheet per day.
+    target is a path or a binary file-like object (e.g. io.BytesIO for a
+    download response).
+
+    Uses xlsxwriter in constant_memory mode, which streams each row to disk
+    as it is written instead of keeping the whole workbook in memory. That
+    mode only keeps cells written in row order, so rows are written here
+    directly (DataFrame.to_excel fills the sheet column by column).
+    """
+    with xlsxwriter.Workbook(target, {"constant_memory": True}) as workbook:
+        for day, day_log in trace.groupby("Day"):
+            sheet = workbook.add_worksheet(f"Day {day}")
+            sheet.write_row(0, 0, day_log.columns)
+            for r, row in enumerate(day_log.itertuples(index=False), start=1):
+                sheet.write_row(r, 0, row)
\ No newline at end of file
@@ -244,4 +244,9 @@ wm_df = pd.DataFrame(prob_women_likes_men, index=women_ids, columns=men_ids)
 wm_df.to_csv("probability_matrix_women_likes_men.csv", index_label="Woman")
 
 mw_df = pd.DataFrame(prob_men_likes_women, index=men_ids, columns=women_ids)
-mw_df.to_csv("probability_matrix_men_likes_women.csv", index_label="Man")
\ No newline at end of file
+mw_df.to_csv("probability_matrix_men_likes_women.csv", index_label="Man")
+
+# Binary float32 copies in the same (profile) order; backend.py memory-maps
+# these instead of re-parsing the CSVs on every start.
+np.save("probability_matrix_women_likes_men.npy", prob_women_likes_men.astype(np.float32))
+np.save("probability_matrix_men_likes_women.npy", prob_men_likes_women.astype(np.float32))
\ No newline at end of file